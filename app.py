@@ -8,14 +8,26 @@
 # - /set_webhook (uses EXPOSED_URL)
 # - /webhook receiver and /healthz for Koyeb
 # Uses: pyTelegramBotAPI (telebot) + Flask
+# Cipher tables and mode persistence live in glyphmoji_core.py
 
 import os
-import json
+import itertools
 import logging
 import requests
-from flask import Flask, request, jsonify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+from flask import Flask, Response, request, jsonify
 import telebot
 
+from glyphmoji_core import (
+    VALID_MODES,
+    get_mode_for_chat,
+    set_mode_for_chat,
+    encode_text_with_mode,
+    decode_text_with_mode,
+)
+
 # ---------- Logging ----------
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("glyphmoji")
@@ -27,136 +39,26 @@ EXPOSED_URL = os.getenv("EXPOSED_URL")  # e.g. https://your-app.koyeb.app
 if not TOKEN:
     raise RuntimeError("TG_TOKEN environment variable is required")
 
-bot = telebot.TeleBot(TOKEN, parse_mode="HTML")
+# Handlers run on telebot's own worker pool (threaded=True is the default), so
+# /webhook only parses and enqueues; size the pool for concurrent sends.
+BOT_THREADS = int(os.getenv("BOT_THREADS", 8))
+bot = telebot.TeleBot(TOKEN, parse_mode="HTML", num_threads=BOT_THREADS)
+
+# Shared keep-alive session for every outbound Telegram API call
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=BOT_THREADS,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+))
+HTTP_TIMEOUT = (3, 10)  # connect, read
+telebot.apihelper.session = _SESSION
 app = Flask(__name__)
 
-# ---------- Emoji mapping (chart) ----------
-CHART_EMOJI = {
-    "a": "😀",   #01
-    "b": "🐒",   #02
-    "c": "🍌",   #03
-    "d": "🍩",   #04
-    "e": "🥚",   #05
-    "f": "🍟",   #06
-    "g": "🦍",   #07
-    "h": "🏡",   #08
-    "i": "🍦",   #09
-    "j": "🕹️",  #10
-    "k": "🔑",   #11
-    "l": "🍋",   #12
-    "m": "🌝",   #13
-    "n": "🎶",   #14
-    "o": "🍊",   #15
-    "p": "🥞",   #16
-    "q": "❓",   #17
-    "r": "🌈",   #18
-    "s": "⭐",   #19
-    "t": "🌴",   #20
-    "u": "☂️",  #21
-    "v": "🌋",   #22
-    "w": "🌊",   #23
-    "x": "❌",   #24
-    "y": "🍸",   #25
-    "z": "⚡",   #26
-    " ": "⬜",    #00 Space
-}
-REV_EMOJI = {v: k for k, v in CHART_EMOJI.items()}
-
-# ---------- Unicode mapping (circled capitals) ----------
-CHART_UNICODE = {
-    "a": "Ⓐ","b": "Ⓑ","c": "Ⓒ","d": "Ⓓ","e": "Ⓔ","f": "Ⓕ",
-    "g": "Ⓖ","h": "Ⓗ","i": "Ⓘ","j": "Ⓙ","k": "Ⓚ","l": "Ⓛ",
-    "m": "Ⓜ","n": "Ⓝ","o": "Ⓞ","p": "Ⓟ","q": "Ⓠ","r": "Ⓡ",
-    "s": "Ⓢ","t": "Ⓣ","u": "Ⓤ","v": "Ⓥ","w": "Ⓦ","x": "Ⓧ",
-    "y": "Ⓨ","z": "Ⓩ"," ": "␣"
-}
-REV_UNICODE = {v: k for k, v in CHART_UNICODE.items()}
-
-# ---------- Modes persistence ----------
-MODES_FILE = "modes.json"
-
-def load_modes():
-    try:
-        with open(MODES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def save_modes(m):
-    try:
-        with open(MODES_FILE, "w", encoding="utf-8") as f:
-            json.dump(m, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.exception("Failed to save modes: %s", e)
-
-modes = load_modes()
-
-def get_mode_for_chat(chat_id: int) -> str:
-    return modes.get(str(chat_id), "emoji")
-
-def set_mode_for_chat(chat_id: int, mode: str):
-    modes[str(chat_id)] = mode
-    save_modes(modes)
-
-# ---------- Encoding / Decoding helpers ----------
-def encode_emoji_text(text: str) -> str:
-    out = []
-    for ch in text:
-        mapped = CHART_EMOJI.get(ch) or CHART_EMOJI.get(ch.lower())
-        out.append(mapped if mapped is not None else ch)
-    return "".join(out)
-
-def decode_emoji_text(glyphs: str) -> str:
-    out = []
-    i = 0
-    keys = sorted(REV_EMOJI.keys(), key=len, reverse=True)
-    max_len = len(keys[0]) if keys else 1
-    while i < len(glyphs):
-        matched = False
-        for L in range(max_len, 0, -1):
-            tok = glyphs[i:i+L]
-            if tok in REV_EMOJI:
-                out.append(REV_EMOJI[tok])
-                i += L
-                matched = True
-                break
-        if not matched:
-            out.append(glyphs[i])
-            i += 1
-    return "".join(out)
-
-def unicode_encode(text: str) -> str:
-    parts = []
-    for ch in text:
-        parts.append(f"\\u{ord(ch):04x}")
-    return " ".join(parts)
-
-def unicode_decode(text: str) -> str:
-    parts = text.split()
-    out = []
-    for p in parts:
-        if p.startswith("\\u"):
-            try:
-                out.append(chr(int(p[2:], 16)))
-            except Exception:
-                out.append(p)
-        else:
-            out.append(p)
-    return "".join(out)
-
-def encode_text_with_mode(text: str, mode: str) -> str:
-    if mode == "emoji":
-        return encode_emoji_text(text)
-    elif mode == "unicode":
-        return unicode_encode(text)
-    return text
-
-def decode_text_with_mode(text: str, mode: str) -> str:
-    if mode == "emoji":
-        return decode_emoji_text(text)
-    elif mode == "unicode":
-        return unicode_decode(text)
-    return text
+# Cipher output is user-controlled; send it without HTML parsing so "<" or "&"
+# reach the chat verbatim. telebot treats parse_mode=None as "use the bot
+# default", so an empty string is what actually disables it.
+PLAIN_TEXT = ""
 
 @bot.message_handler(commands=['start'])
 def handle_start(message):
@@ -195,16 +97,17 @@ def handle_mode(message):
 def handle_changemod(message):
     logger.info("changemod handler called — chat=%s text=%s", getattr(getattr(message, 'chat', None), 'id', None), getattr(message, 'text', None))
     chat_id = message.chat.id
-    parts = message.text.split()
-    current = get_mode_for_chat(chat_id)
-    if len(parts) > 1:
-        arg = parts[1].lower()
-        if arg not in ("emoji", "unicode"):
+    # command, first argument, rest: splits on any whitespace but stops early
+    parts = message.text.split(None, 2)
+    arg = parts[1].lower() if len(parts) > 1 else ""
+    if arg:
+        if arg not in VALID_MODES:
             bot.send_message(chat_id, "Invalid mode. Use 'emoji' or 'unicode'.")
             return
         set_mode_for_chat(chat_id, arg)
         bot.send_message(chat_id, f"Mode set to <b>{arg}</b>")
     else:
+        current = get_mode_for_chat(chat_id)
         new = "unicode" if current == "emoji" else "emoji"
         set_mode_for_chat(chat_id, new)
         bot.send_message(chat_id, f"Toggled mode: <b>{new}</b>")
@@ -219,7 +122,7 @@ def handle_encode(message):
         return
     mode = get_mode_for_chat(chat_id)
     res = encode_text_with_mode(txt, mode)
-    bot.send_message(chat_id, res)
+    bot.send_message(chat_id, res, parse_mode=PLAIN_TEXT)
 
 @bot.message_handler(commands=['decode'])
 def handle_decode(message):
@@ -227,11 +130,11 @@ def handle_decode(message):
     chat_id = message.chat.id
     txt = message.text.partition(' ')[2].strip()
     if not txt:
-        bot.send_message(chat_id, "Usage: /decode <glyphs>")
+        bot.send_message(chat_id, "Usage: /decode <glyphs>", parse_mode=PLAIN_TEXT)
         return
     mode = get_mode_for_chat(chat_id)
     res = decode_text_with_mode(txt, mode)
-    bot.send_message(chat_id, res)
+    bot.send_message(chat_id, res, parse_mode=PLAIN_TEXT)
 
 @bot.message_handler(func=lambda m: True, content_types=['text'])
 def handle_plain_text(message):
@@ -250,20 +153,30 @@ def handle_plain_text(message):
     chat_id = message.chat.id
     mode = get_mode_for_chat(chat_id)
     res = encode_text_with_mode(txt, mode)
-    bot.send_message(chat_id, res)
+    bot.send_message(chat_id, res, parse_mode=PLAIN_TEXT)
 
 # ---------- Flask routes: webhook, set_webhook, healthz ----------
+# Raw updates are logged in full at DEBUG; at INFO only one in every N is kept
+# (N <= 0 turns INFO sampling off).
+_UPDATE_LOG_EVERY = int(os.getenv("UPDATE_LOG_EVERY", 100))
+_update_counter = itertools.count()
+_OK_BODY = b'{"ok":true}'
+
 @app.post("/webhook")
 def webhook():
     try:
-        update_json = request.get_json(force=True)
-        logger.info("Incoming raw update: %s", update_json)   # <-- debug log
+        # body is read exactly once, so skip Flask's cache and MIME checks
+        update_json = orjson.loads(request.get_data(cache=False))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Incoming raw update: %s", update_json)
+        elif _UPDATE_LOG_EVERY > 0 and next(_update_counter) % _UPDATE_LOG_EVERY == 0:
+            logger.info("Incoming raw update (sampled 1/%d): %s", _UPDATE_LOG_EVERY, update_json)
         update = telebot.types.Update.de_json(update_json)
         bot.process_new_updates([update])
     except Exception as e:
         logger.exception("Error processing update: %s", e)
         return jsonify({"ok": False, "error": str(e)}), 500
-    return jsonify({"ok": True})
+    return Response(_OK_BODY, mimetype="application/json")
 
 @app.get("/set_webhook")
 def set_webhook():
@@ -276,7 +189,7 @@ def set_webhook():
     webhook_url = f"{exposed.rstrip('/')}/webhook"
     telegram_api = f"https://api.telegram.org/bot{token}/setWebhook"
     try:
-        r = requests.post(telegram_api, data={"url": webhook_url})
+        r = _SESSION.post(telegram_api, data={"url": webhook_url}, timeout=HTTP_TIMEOUT)
         logger.info("set_webhook response: %s", r.text)
         return (r.json(), r.status_code) if r.headers.get("content-type","").startswith("application/json") else (r.text, r.status_code)
     except Exception as e:
@@ -288,6 +201,7 @@ def health():
     return jsonify({"status": "ok"}), 200
 
 # ---------- Start (flask) ----------
+# Local development only; production runs under gunicorn (see Dockerfile).
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     logger.info("Starting Flask on port %s", port)
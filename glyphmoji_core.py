@@ -0,0 +1,223 @@
+# glyphmoji_core.py
+# Cipher tables, encode/decode helpers and per-chat mode persistence shared by
+# the bot entrypoint. Framework-free: importing it needs no token or Flask.
+
+import os
+import re
+import json
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger("glyphmoji")
+
+# ---------- Emoji mapping (chart) ----------
+CHART_EMOJI = {
+    "a": "😀",   #01
+    "b": "🐒",   #02
+    "c": "🍌",   #03
+    "d": "🍩",   #04
+    "e": "🥚",   #05
+    "f": "🍟",   #06
+    "g": "🦍",   #07
+    "h": "🏡",   #08
+    "i": "🍦",   #09
+    "j": "🕹️",  #10
+    "k": "🔑",   #11
+    "l": "🍋",   #12
+    "m": "🌝",   #13
+    "n": "🎶",   #14
+    "o": "🍊",   #15
+    "p": "🥞",   #16
+    "q": "❓",   #17
+    "r": "🌈",   #18
+    "s": "⭐",   #19
+    "t": "🌴",   #20
+    "u": "☂️",  #21
+    "v": "🌋",   #22
+    "w": "🌊",   #23
+    "x": "❌",   #24
+    "y": "🍸",   #25
+    "z": "⚡",   #26
+    " ": "⬜",    #00 Space
+}
+REV_EMOJI = {v: k for k, v in CHART_EMOJI.items()}
+# translation table for the encoder; case is folded into the table up front so
+# every char that lower()s onto a chart key costs a single lookup
+_EMOJI_TRANS = str.maketrans({
+    **{k.upper(): v for k, v in CHART_EMOJI.items()},
+    "\u212a": CHART_EMOJI["k"],  # KELVIN SIGN, the only non-ASCII char lowering to a-z
+    **CHART_EMOJI,
+})
+# single-pass decoder: alternatives are ordered longest first so tokens with a
+# variation selector win over their bare prefix at the same position
+_REV_EMOJI_RE = re.compile("|".join(
+    re.escape(k) for k in sorted(REV_EMOJI, key=len, reverse=True)
+))
+# True when no glyph token starts with an ASCII char, so ASCII-only input can be
+# returned as-is without running the decoder
+_REV_EMOJI_ASCII_FREE = not any(k[0].isascii() for k in REV_EMOJI)
+
+# ---------- Unicode mapping (circled capitals) ----------
+CHART_UNICODE = {
+    "a": "Ⓐ","b": "Ⓑ","c": "Ⓒ","d": "Ⓓ","e": "Ⓔ","f": "Ⓕ",
+    "g": "Ⓖ","h": "Ⓗ","i": "Ⓘ","j": "Ⓙ","k": "Ⓚ","l": "Ⓛ",
+    "m": "Ⓜ","n": "Ⓝ","o": "Ⓞ","p": "Ⓟ","q": "Ⓠ","r": "Ⓡ",
+    "s": "Ⓢ","t": "Ⓣ","u": "Ⓤ","v": "Ⓥ","w": "Ⓦ","x": "Ⓧ",
+    "y": "Ⓨ","z": "Ⓩ"," ": "␣"
+}
+REV_UNICODE = {v: k for k, v in CHART_UNICODE.items()}
+# precomputed \uXXXX escapes for the ASCII range
+_ASCII_UESC = [f"\\u{i:04x}" for i in range(128)]
+_ASCII_UESC_TRANS = str.maketrans({chr(i): e + " " for i, e in enumerate(_ASCII_UESC)})
+_UESC_TOKEN_RE = re.compile(r"\\u([0-9a-fA-F]+)")
+_UESC_CACHE_MAX = 4096
+
+class _UescTable(dict):
+    """\\uXXXX token -> character. Unknown tokens are decoded on first sight and
+    cached (up to _UESC_CACHE_MAX); anything that isn't an escape maps to itself."""
+
+    def __missing__(self, tok: str) -> str:
+        if not tok.startswith("\\u"):
+            return tok
+        m = _UESC_TOKEN_RE.fullmatch(tok)
+        if m is None:
+            return tok
+        try:
+            ch = chr(int(m[1], 16))
+        except (ValueError, OverflowError):
+            return tok
+        if len(self) < _UESC_CACHE_MAX:
+            self[tok] = ch
+        return ch
+
+# decoder table, pre-seeded with the escapes unicode_encode emits for ASCII
+_UESC_TABLE = _UescTable({e: chr(i) for i, e in enumerate(_ASCII_UESC)})
+
+# ---------- Modes persistence ----------
+MODES_FILE = "modes.json"
+VALID_MODES = frozenset(("emoji", "unicode"))
+MODES_FLUSH_DELAY = 0.5  # seconds; coalesces bursts of /changemod into one write
+
+try:
+    import orjson
+
+    def _dump(m) -> bytes:
+        return orjson.dumps(m, option=orjson.OPT_INDENT_2)
+
+    _load = orjson.loads
+except ImportError:
+    def _dump(m) -> bytes:
+        return json.dumps(m, ensure_ascii=False, indent=2).encode("utf-8")
+
+    _load = json.loads
+
+def load_modes():
+    try:
+        with open(MODES_FILE, "rb") as f:
+            return _load(f.read())
+    except Exception:
+        return {}
+
+def save_modes(m):
+    # write to a temp file and swap it in so a crash never leaves a torn modes.json
+    tmp = f"{MODES_FILE}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_dump(m))
+        os.replace(tmp, MODES_FILE)
+    except Exception as e:
+        logger.exception("Failed to save modes: %s", e)
+
+modes = load_modes()
+# int chat_id -> mode, filled lazily so lookups skip the str() key conversion
+_MODE_CACHE: dict[int, str] = {}
+
+def get_mode_for_chat(chat_id: int) -> str:
+    m = _MODE_CACHE.get(chat_id)
+    if m is not None:
+        return m
+    m = modes.get(str(chat_id), "emoji")
+    # setdefault: a concurrent set_mode_for_chat that already cached a newer
+    # mode must win over the value read above
+    return _MODE_CACHE.setdefault(chat_id, m)
+
+def set_mode_for_chat(chat_id: int, mode: str):
+    # update both under the lock so concurrent setters can't leave the cache
+    # disagreeing with what gets persisted
+    with _flush_lock:
+        modes[str(chat_id)] = mode
+        _MODE_CACHE[chat_id] = mode
+    _schedule_flush()
+
+# ---------- Debounced persistence ----------
+_dirty = False
+_flush_timer = None
+_flush_lock = threading.Lock()  # guards modes/_dirty/_flush_timer; never held over I/O
+_write_lock = threading.Lock()  # serializes file writes so snapshots land in order
+
+def _schedule_flush():
+    global _dirty, _flush_timer
+    with _flush_lock:
+        _dirty = True
+        # one pending timer at most: later changes ride along with it, so a
+        # change is written within MODES_FLUSH_DELAY even under steady traffic
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(MODES_FLUSH_DELAY, _do_flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+def _do_flush():
+    global _dirty, _flush_timer
+    # Snapshot under _write_lock so a later flush can only ever write a newer
+    # snapshot; the disk write itself runs outside _flush_lock, so handlers
+    # calling set_mode_for_chat never wait on it.
+    with _write_lock:
+        with _flush_lock:
+            # only the firing timer clears itself; an atexit/manual flush must
+            # not drop the reference to a still-pending timer
+            if _flush_timer is threading.current_thread():
+                _flush_timer = None
+            if not _dirty:
+                return
+            _dirty = False
+            snapshot = dict(modes)
+        save_modes(snapshot)
+
+atexit.register(_do_flush)
+
+# ---------- Encoding / Decoding helpers ----------
+def encode_emoji_text(text: str) -> str:
+    return text.translate(_EMOJI_TRANS)
+
+def _rev_emoji_sub(m) -> str:
+    return REV_EMOJI[m[0]]
+
+def decode_emoji_text(glyphs: str) -> str:
+    if _REV_EMOJI_ASCII_FREE and glyphs.isascii():
+        return glyphs
+    return _REV_EMOJI_RE.sub(_rev_emoji_sub, glyphs)
+
+def unicode_encode(text: str) -> str:
+    if text.isascii():
+        # one translate pass into a single buffer, minus the trailing separator
+        return text.translate(_ASCII_UESC_TRANS)[:-1]
+    return " ".join([_ASCII_UESC[o] if o < 128 else f"\\u{o:04x}" for o in map(ord, text)])
+
+def unicode_decode(text: str) -> str:
+    # split() and the table lookups both run in C; only unseen tokens reach Python
+    return "".join(map(_UESC_TABLE.__getitem__, text.split()))
+
+def encode_text_with_mode(text: str, mode: str) -> str:
+    if mode == "emoji":
+        return encode_emoji_text(text)
+    elif mode == "unicode":
+        return unicode_encode(text)
+    return text
+
+def decode_text_with_mode(text: str, mode: str) -> str:
+    if mode == "emoji":
+        return decode_emoji_text(text)
+    elif mode == "unicode":
+        return unicode_decode(text)
+    return text